@@ -3,20 +3,37 @@ YAPBATTLE Web Server
 Flask application to serve the game UI and handle voice interactions
 """
 
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, request
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
+from dataclasses import dataclass, field
 from user_data import UserData
-from debate_engine import DebateEngine
-from voice_handler_simple import VoiceDebateHandler
+from session_store import ShardedSessionStore
+from typing import TYPE_CHECKING
 import threading
 import os
 import random
-import base64
 import sys
 import logging
 
 from prompts_config import get_prompt, get_random_topic
 
+if TYPE_CHECKING:
+    from debate_engine import DebateEngine
+
+# orjson is optional; Flask's stdlib-json provider is used without it
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# pybase64 (SIMD libbase64, picks the codec for the running CPU) decodes audio
+# several times faster; stdlib base64 has the same API
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
 # Try to load .env file if it exists (optional, falls back to system env vars)
 try:
     from dotenv import load_dotenv
@@ -31,24 +48,102 @@ except Exception as e:
     pass
 
 # Configure logging to stderr
+# Per-request diagnostics are logged at DEBUG; set LOG_LEVEL=DEBUG to see them
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=os.environ.get('LOG_LEVEL', 'WARNING').upper(),
     format='%(asctime)s - %(levelname)s - %(message)s',
     stream=sys.stderr
 )
 logger = logging.getLogger(__name__)
 
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, used for request.json and dict responses"""
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode('utf-8')
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response, skipping the str round-trip
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=self.default),
+            mimetype=self.mimetype
+        )
+
+
 app = Flask(__name__)
+if orjson is not None:
+    app.json = OrjsonProvider(app)
 CORS(app)
 
-# Global user data
-user_data = UserData()
+_JSON_CONTENT_TYPE = 'application/json'
+
+
+def api(payload, status=200):
+    """Build an API route's JSON response straight from the encoded body"""
+    if orjson is not None:
+        body = orjson.dumps(payload)
+    else:
+        body = app.json.dumps(payload).encode('utf-8')
+    return Response(body, status=status, content_type=_JSON_CONTENT_TYPE)
 
-# Active debate sessions (in-memory for now)
-debate_sessions = {}
+
+# DebateEngine and VoiceDebateHandler pull in the Anthropic SDK and httpx,
+# so they're imported on first use; pages and /api/user-stats don't need them
+_debate_engine_cls = None
+_voice_handler_cls = None
+
+
+def _get_engine_cls():
+    """Import DebateEngine on first use"""
+    global _debate_engine_cls
+    if _debate_engine_cls is None:
+        from debate_engine import DebateEngine
+        _debate_engine_cls = DebateEngine
+    return _debate_engine_cls
+
+
+def _get_voice_handler_cls():
+    """Import VoiceDebateHandler on first use"""
+    global _voice_handler_cls
+    if _voice_handler_cls is None:
+        from voice_handler_simple import VoiceDebateHandler
+        _voice_handler_cls = VoiceDebateHandler
+    return _voice_handler_cls
+
+
+# Global user data (saved from a background thread so end-debate doesn't wait on disk)
+user_data = UserData(write_behind=True)
+
+
+@dataclass
+class DebateSession:
+    """An active debate and the settings it was started with"""
+    engine: "DebateEngine"
+    topic: str
+    mode: str
+    difficulty: str
+    lock: threading.Lock = field(default_factory=threading.Lock)  # Serializes turns within one debate
+
+
+def _evict_debate_session(session_id, session):
+    """Release the voice handler of a debate that expired without end-debate"""
+    handler = voice_handlers.pop(session_id)
+    if handler:
+        handler.cleanup()
+
+
+# Active debate sessions (in-memory, idle ones expire after an hour).
+# Sharded so concurrent requests for different sessions don't share one lock.
+debate_sessions = ShardedSessionStore(shards=64, maxsize=2048, ttl=3600, on_evict=_evict_debate_session)
 
 # Active voice handlers  
-voice_handlers = {}
+voice_handlers = ShardedSessionStore(shards=64, maxsize=2048, ttl=3600,
+                                     on_evict=lambda session_id, handler: handler.cleanup())
 
 
 @app.route('/')
@@ -60,7 +155,7 @@ def home():
 @app.route('/api/user-stats')
 def get_user_stats():
     """API endpoint to get user statistics"""
-    return jsonify({
+    return api({
         'rank': user_data['rank'],
         'rank_icon': user_data.get_rank_icon(),
         'rank_color': user_data.get_rank_color(),
@@ -104,35 +199,30 @@ def start_debate():
         mode = data.get('mode', 'ranked')
         difficulty = data.get('difficulty', 'medium')
         
-        logger.info(f"🎯 Starting debate: mode={mode}, difficulty={difficulty}")
+        logger.info("🎯 Starting debate: mode=%s, difficulty=%s", mode, difficulty)
         
         # Get random topic based on mode
         topic = get_random_topic(mode)
-        logger.info(f"📝 Topic selected: {topic}")
+        logger.info("📝 Topic selected: %s", topic)
         
         # Create debate engine
         anthropic_key = os.environ.get('ANTHROPIC_API_KEY')
         if not anthropic_key:
             logger.error("❌ Missing Anthropic API key!")
-            return jsonify({
+            return api({
                 'success': False,
                 'error': 'Anthropic API key not configured'
-            }), 500
+            }, 500)
         
         session_id = f"{mode}_{difficulty}_{random.randint(1000, 9999)}"
-        logger.info(f"🔑 Creating debate engine for session: {session_id}")
+        logger.info("🔑 Creating debate engine for session: %s", session_id)
         
-        engine = DebateEngine(anthropic_key, difficulty, topic, mode)
-        logger.info(f"✅ Engine created, config: {engine.config.keys()}")
+        engine = _get_engine_cls()(anthropic_key, difficulty, topic, mode)
+        logger.info("✅ Engine created, config: %s", engine.config.keys())
         
-        debate_sessions[session_id] = {
-            'engine': engine,
-            'topic': topic,
-            'mode': mode,
-            'difficulty': difficulty
-        }
+        debate_sessions[session_id] = DebateSession(engine, topic, mode, difficulty)
         
-        return jsonify({
+        return api({
             'success': True,
             'session_id': session_id,
             'topic': topic,
@@ -141,14 +231,12 @@ def start_debate():
             'config': engine.config
         })
     except Exception as e:
-        error_msg = f"❌ Error starting debate: {str(e)}"
-        logger.error(error_msg)
-        logger.exception("Full traceback:")
+        logger.exception("❌ Error starting debate: %s", e)
         
-        return jsonify({
+        return api({
             'success': False,
             'error': str(e)
-        }), 500
+        }, 500)
 
 
 @app.route('/api/process-argument', methods=['POST'])
@@ -158,58 +246,83 @@ def process_argument():
     session_id = data.get('session_id')
     user_text = data.get('text')
     
-    print(f"🎤 Received argument from session {session_id}: {user_text[:50]}...")
+    logger.debug("🎤 Received argument from session %s: %.50s...", session_id, user_text)
     
     if session_id not in debate_sessions:
-        print(f"❌ Invalid session: {session_id}")
-        return jsonify({
+        logger.warning("❌ Invalid session: %s", session_id)
+        return api({
             'success': False,
             'error': 'Invalid session'
-        }), 400
+        }, 400)
     
     session = debate_sessions[session_id]
-    engine = session['engine']
+    engine = session.engine
+    
+    # Clients that accept Server-Sent Events get scores first, then the reply as it streams
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        return Response(
+            _stream_argument(session, user_text),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
     
     try:
-        print(f"🤖 Processing with Claude...")
-        result = engine.process_user_argument(user_text)
+        logger.debug("🤖 Processing with Claude...")
+        with session.lock:
+            result = engine.process_user_argument(user_text)
         
-        print(f"✅ Got result:")
-        print(f"   AI Response: {result['ai_response'][:100]}...")
-        print(f"   Scores: {result.get('scores')}")
-        print(f"   Feedback: {result.get('feedback')}")
+        logger.debug(
+            "✅ Got result:\n   AI Response: %.100s...\n   Scores: %s\n   Feedback: %s",
+            result.ai_response, result.scores, result.feedback
+        )
         
-        return jsonify({
+        return api({
             'success': True,
-            'ai_response': result['ai_response'],
-            'scores': result.get('scores'),
-            'feedback': result.get('feedback')
+            'ai_response': result.ai_response,
+            'scores': result.scores,
+            'feedback': result.feedback
         })
     except Exception as e:
-        print(f"❌ Error processing argument: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({
+        logger.exception("❌ Error processing argument: %s", e)
+        return api({
             'success': False,
             'error': str(e)
-        }), 500
+        }, 500)
+
+
+def _stream_argument(session, user_text):
+    """Format DebateEngine.process_user_argument_stream events as SSE"""
+    with session.lock:
+        try:
+            for event, payload in session.engine.process_user_argument_stream(user_text):
+                yield f"event: {event}\ndata: {app.json.dumps(payload)}\n\n"
+        except Exception as e:
+            logger.exception("❌ Error streaming argument: %s", e)
+            yield f"event: error\ndata: {app.json.dumps({'error': str(e)})}\n\n"
 
 
 @app.route('/api/get-scores/<session_id>')
 def get_scores(session_id):
     """Get current debate scores"""
     if session_id not in debate_sessions:
-        return jsonify({'success': False, 'error': 'Invalid session'}), 400
+        return api({'success': False, 'error': 'Invalid session'}, 400)
     
-    engine = debate_sessions[session_id]['engine']
+    engine = debate_sessions[session_id].engine
     scores = engine.get_current_scores()
     
-    return jsonify({
+    return api({
         'success': True,
         'scores': scores
     })
 
 
+@app.route('/api/cache-stats')
+def cache_stats():
+    """Hit/miss counters for the cached opening replies"""
+    from debate_engine import get_reply_cache_stats
+    return api(get_reply_cache_stats())
+
+
 @app.route('/stats')
 def stats():
     """Serve the stats page"""
@@ -225,7 +338,7 @@ def stats():
         'wins': user_data['wins'],
         'losses': user_data['losses'],
         'win_rate': user_data.get_win_rate(),
-        'average_score': user_data['average_score'],
+        'average_score': user_data.get_average_score(),
         'ranked_played': user_data['ranked_played'],
         'hot_takes_played': user_data['hot_takes_played'],
         'podcast_played': user_data['podcast_played'],
@@ -245,7 +358,7 @@ def init_voice():
     session_id = data.get('session_id')
     
     if session_id not in debate_sessions:
-        return jsonify({'success': False, 'error': 'Invalid session'}), 400
+        return api({'success': False, 'error': 'Invalid session'}, 400)
     
     session = debate_sessions[session_id]
     
@@ -254,22 +367,29 @@ def init_voice():
     anthropic_key = os.environ.get('ANTHROPIC_API_KEY')
     
     if not deepgram_key or not anthropic_key:
-        return jsonify({'success': False, 'error': 'API keys not configured'}), 500
+        return api({'success': False, 'error': 'API keys not configured'}, 500)
     
-    # Create voice handler
-    voice_handler = VoiceDebateHandler(
+    # Create voice handler on the session's engine, so voice turns count
+    # toward the same history and final scores as typed ones
+    voice_handler = _get_voice_handler_cls()(
         deepgram_key,
         anthropic_key,
-        session['difficulty'],
-        session['topic'],
-        session.get('mode', 'ranked')
+        session.difficulty,
+        session.topic,
+        session.mode,
+        debate_engine=session.engine
     )
     
+    # Re-initializing replaces the handler; the store doesn't evict on overwrite,
+    # so release the old one's TTS pool here
+    previous = voice_handlers.pop(session_id)
+    if previous:
+        previous.cleanup()
     voice_handlers[session_id] = voice_handler
     
-    print(f"🎤 Voice initialized for session {session_id}")
+    logger.debug("🎤 Voice initialized for session %s", session_id)
     
-    return jsonify({'success': True, 'message': 'Voice system ready'})
+    return api({'success': True, 'message': 'Voice system ready'})
 
 
 @app.route('/api/voice/transcribe', methods=['POST'])
@@ -280,24 +400,52 @@ def transcribe_audio():
     audio_base64 = data.get('audio')
     
     if session_id not in voice_handlers:
-        return jsonify({'success': False, 'error': 'Voice handler not initialized'}), 400
+        return api({'success': False, 'error': 'Voice handler not initialized'}, 400)
     
     try:
         # Decode base64 audio
-        audio_data = base64.b64decode(audio_base64)
+        audio_data = base64.b64decode(audio_base64, validate=False)
         
         # Transcribe
         handler = voice_handlers[session_id]
         transcript = handler.transcribe_audio(audio_data)
         
-        return jsonify({
+        return api({
             'success': True,
             'transcript': transcript
         })
         
     except Exception as e:
-        print(f"❌ Transcription error: {e}")
-        return jsonify({'success': False, 'error': str(e)}), 500
+        logger.error("❌ Transcription error: %s", e)
+        return api({'success': False, 'error': str(e)}, 500)
+
+
+@app.route('/api/voice/transcribe-raw', methods=['POST'])
+def transcribe_raw_audio():
+    """Transcribe a raw audio request body (e.g. a Blob sent as audio/webm)
+
+    Same as /api/voice/transcribe without the JSON/base64 wrapping;
+    the session is passed as ?session_id=...
+    """
+    session_id = request.args.get('session_id')
+
+    if session_id not in voice_handlers:
+        return api({'success': False, 'error': 'Voice handler not initialized'}, 400)
+
+    try:
+        audio_data = request.get_data(cache=False)
+
+        handler = voice_handlers[session_id]
+        transcript = handler.transcribe_audio(audio_data)
+
+        return api({
+            'success': True,
+            'transcript': transcript
+        })
+
+    except Exception as e:
+        logger.error("❌ Transcription error: %s", e)
+        return api({'success': False, 'error': str(e)}, 500)
 
 
 @app.route('/api/voice/process', methods=['POST'])
@@ -307,18 +455,19 @@ def process_voice_argument():
     session_id = data.get('session_id')
     user_text = data.get('text')
     
-    print(f"🎤 Voice argument from session {session_id}: {user_text[:50]}...")
+    logger.debug("🎤 Voice argument from session %s: %.50s...", session_id, user_text)
     
     if session_id not in voice_handlers:
-        return jsonify({'success': False, 'error': 'Voice handler not initialized'}), 400
+        return api({'success': False, 'error': 'Voice handler not initialized'}, 400)
     
     try:
         handler = voice_handlers[session_id]
-        result = handler.process_argument(user_text)
+        with debate_sessions[session_id].lock:
+            result = handler.process_argument(user_text)
         
         if result:
-            print(f"✅ Processed voice argument successfully")
-            return jsonify({
+            logger.debug("✅ Processed voice argument successfully")
+            return api({
                 'success': True,
                 'ai_response': result['ai_response'],
                 'scores': result.get('scores'),
@@ -326,13 +475,35 @@ def process_voice_argument():
                 'audio': result.get('audio')  # base64 encoded MP3
             })
         else:
-            return jsonify({'success': False, 'error': 'Processing failed'}), 500
+            return api({'success': False, 'error': 'Processing failed'}, 500)
             
     except Exception as e:
-        print(f"❌ Error processing voice argument: {e}")
-        import traceback
-        traceback.print_exc()
-        return jsonify({'success': False, 'error': str(e)}), 500
+        logger.exception("❌ Error processing voice argument: %s", e)
+        return api({'success': False, 'error': str(e)}, 500)
+
+
+@app.route('/api/voice/speak', methods=['POST'])
+def speak_text():
+    """Stream TTS audio for text as audio/mpeg
+
+    The browser can start playback on the first chunk instead of waiting
+    for a complete base64 clip inside a JSON response.
+    """
+    data = request.json
+    session_id = data.get('session_id')
+    text = data.get('text')
+
+    if session_id not in voice_handlers:
+        return api({'success': False, 'error': 'Voice handler not initialized'}, 400)
+
+    if not text:
+        return api({'success': False, 'error': 'No text provided'}, 400)
+
+    audio = voice_handlers[session_id].speak_response_stream(text)
+    if audio is None:
+        return api({'success': False, 'error': 'Speech generation failed'}, 502)
+
+    return Response(audio, mimetype='audio/mpeg')
 
 
 @app.route('/api/end-debate', methods=['POST'])
@@ -342,12 +513,12 @@ def end_debate():
     session_id = data.get('session_id')
     
     if session_id not in debate_sessions:
-        return jsonify({'success': False, 'error': 'Invalid session'}), 400
+        return api({'success': False, 'error': 'Invalid session'}, 400)
     
     session = debate_sessions[session_id]
-    engine = session['engine']
-    difficulty = session['difficulty']
-    mode = session['mode']
+    engine = session.engine
+    difficulty = session.difficulty
+    mode = session.mode
     
     # Get final scores
     scores = engine.get_current_scores()
@@ -358,11 +529,11 @@ def end_debate():
     
     # Clean up session
     del debate_sessions[session_id]
-    if session_id in voice_handlers:
-        voice_handlers[session_id].cleanup()
-        del voice_handlers[session_id]
+    handler = voice_handlers.pop(session_id)
+    if handler:
+        handler.cleanup()
     
-    return jsonify({
+    return api({
         'success': True,
         'final_scores': scores,
         'elo_change': result['elo_change'],
@@ -374,11 +545,11 @@ def end_debate():
 
 
 def run_server(host='0.0.0.0', port=5001, debug=False):
-    """Run the Flask server"""
+    """Run the Flask development server (production: `gunicorn app:app`, see gunicorn.conf.py)"""
     print(f"\n🌐 YAPBATTLE Web Server Starting...")
     print(f"📍 Open your browser to: http://localhost:{port}")
     print(f"🎮 Ready to battle!\n")
-    app.run(host=host, port=port, debug=debug, load_dotenv=False)
+    app.run(host=host, port=port, debug=debug, threaded=True, load_dotenv=False)
 
 
 if __name__ == '__main__':
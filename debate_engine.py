@@ -1,243 +1,360 @@
 """
-Debate Engine with Claude Function Calling
+Debate Engine with inline Claude scoring
 Handles scoring, argument analysis, and AI opponent behavior
 """
 
 from anthropic import Anthropic
-import json
-from typing import Dict, List, Any
+from dataclasses import dataclass
+import hashlib
+import logging
+import re
+import threading
+from typing import Dict, List, Any, Iterator, Optional, Tuple
 from prompts_config import get_prompt
+from session_store import SessionStore
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
+# Scores block Claude puts at the start of each reply (see prompts_config.SCORES_FORMAT),
+# though it sometimes writes a few words first
+_SCORES_PATTERN = re.compile(r"<scores>(.*?)</scores>", re.S)
+_SCORES_OPEN = "<scores>"
+_SCORES_CLOSE = "</scores>"
+
+logger = logging.getLogger(__name__)
+
+# Opening replies, keyed by (mode, difficulty, topic, normalized argument digest).
+# With an empty history that key fully determines the request, and many players
+# open with the same few lines on the same hot take.
+_opening_replies = SessionStore(maxsize=4096, ttl=None)
+_opening_reply_stats = {"hits": 0, "misses": 0}
+_opening_reply_stats_lock = threading.Lock()  # Turns run on concurrent threads/greenlets
+
+# One client per API key, shared by every engine so debates reuse its pooled
+# keep-alive connections instead of each session paying a fresh TLS handshake
+_clients: Dict[str, Anthropic] = {}
+_clients_lock = threading.Lock()
+
+
+def _get_client(api_key: str) -> Anthropic:
+    """Get the shared Anthropic client for an API key"""
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = _clients[api_key] = Anthropic(api_key=api_key)
+        return client
+
+
+@dataclass
+class DebateResult:
+    """Outcome of one user argument"""
+    ai_response: str = ""
+    scores: Optional[Dict[str, float]] = None
+    feedback: Optional[str] = None
+
+
+def get_reply_cache_stats() -> Dict[str, int]:
+    """Hit/miss counters for the opening-reply cache"""
+    with _opening_reply_stats_lock:
+        stats = dict(_opening_reply_stats)
+    return {**stats, "size": len(_opening_replies)}
+
+
+def _split_scores(reply: str) -> Tuple[Optional[Tuple[float, float, float]], str, str]:
+    """Split a reply into ((clarity, argument, rhetoric) or None, feedback, spoken text)"""
+    match = _SCORES_PATTERN.search(reply)
+    if not match:
+        return None, "", reply.strip()
+    
+    spoken = (reply[:match.start()] + reply[match.end():]).strip()
+    try:
+        raw = json_loads(match.group(1))
+        scores = (float(raw["clarity"]), float(raw["argument"]), float(raw["rhetoric"]))
+        feedback = str(raw.get("feedback", ""))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        logger.warning("❌ Could not parse scores: %.100s", match.group(1))
+        return None, "", spoken
+    return scores, feedback, spoken
+
+
+def _take_spoken(pending: str) -> Tuple[str, Optional[str], str]:
+    """Split streamed text into (text safe to send, complete scores block or None, text to hold back)"""
+    start = pending.find(_SCORES_OPEN)
+    if start < 0:
+        # Hold back a trailing partial "<scores>" tag
+        for size in range(min(len(pending), len(_SCORES_OPEN) - 1), 0, -1):
+            if pending.endswith(_SCORES_OPEN[:size]):
+                return pending[:-size], None, pending[-size:]
+        return pending, None, ""
+    
+    end = pending.find(_SCORES_CLOSE, start)
+    if end < 0:
+        return pending[:start], None, pending[start:]
+    end += len(_SCORES_CLOSE)
+    return pending[:start], pending[start:end], pending[end:]
 
 
 class DebateEngine:
     """Manages debate logic, scoring, and AI opponent"""
     
     def __init__(self, api_key: str, difficulty: str = "medium", topic: str = "", mode: str = "ranked"):
-        self.client = Anthropic(api_key=api_key)
+        self.client = _get_client(api_key)
         self.difficulty = difficulty
         self.topic = topic
         self.mode = mode
         self.conversation_history = []
-        self.scores = {
-            "clarity": 0,
-            "argument": 0,
-            "rhetoric": 0,
-            "overall": 0
-        }
+        
+        # Older turns are folded into a running summary so requests stay small.
+        # A turn is one user argument plus Claude's reply (two messages).
+        self.max_turns = 12  # Turns allowed in history before trimming
+        self.keep_turns = 6  # Most recent turns kept verbatim after a trim
+        self.context_summary = ""
+        self._summary_lock = threading.Lock()
+        
+        # Running averages of (clarity, argument, rhetoric); overall is their mean
+        self.score_averages = [0.0, 0.0, 0.0]
         self.argument_count = 0
         
         # Get prompt configuration
         self.config = get_prompt(difficulty, topic, mode)
         self.system_prompt = self.config["system_prompt"]
-        
-        # Define function tools for Claude
-        self.tools = [
-            {
-                "name": "score_argument",
-                "description": "Score the user's argument on clarity, strength, and rhetoric. Use this after each user argument.",
-                "input_schema": {
-                    "type": "object",
-                    "properties": {
-                        "clarity": {
-                            "type": "number",
-                            "description": "How clear and understandable is the argument? (1-10)"
-                        },
-                        "argument_strength": {
-                            "type": "number",
-                            "description": "How strong and logical is the argument? (1-10)"
-                        },
-                        "rhetoric": {
-                            "type": "number",
-                            "description": "How persuasive is the rhetoric and delivery? (1-10)"
-                        },
-                        "feedback": {
-                            "type": "string",
-                            "description": "Brief constructive feedback on the argument"
-                        }
-                    },
-                    "required": ["clarity", "argument_strength", "rhetoric", "feedback"]
-                }
-            },
-            {
-                "name": "generate_counterargument",
-                "description": "Generate a counterargument to the user's point",
-                "input_schema": {
-                    "type": "object",
-                    "properties": {
-                        "user_point": {
-                            "type": "string",
-                            "description": "The main point the user made"
-                        },
-                        "counter_strategy": {
-                            "type": "string",
-                            "description": "The strategy for the counter (logic, emotion, facts, analogy)"
-                        }
-                    },
-                    "required": ["user_point", "counter_strategy"]
-                }
-            },
-            {
-                "name": "end_debate",
-                "description": "Call this to end the debate and provide final scoring",
-                "input_schema": {
-                    "type": "object",
-                    "properties": {
-                        "winner": {
-                            "type": "string",
-                            "description": "Who won the debate: 'user' or 'ai'"
-                        },
-                        "final_score": {
-                            "type": "number",
-                            "description": "Final score out of 100"
-                        },
-                        "summary": {
-                            "type": "string",
-                            "description": "Brief summary of debate performance"
-                        }
-                    },
-                    "required": ["winner", "final_score", "summary"]
-                }
-            }
-        ]
     
     def get_system_prompt_legacy(self, topic: str) -> str:
         """Legacy system prompt method (kept for backwards compatibility)"""
         return self.system_prompt
     
-    def process_user_argument(self, user_text: str) -> Dict[str, Any]:
-        """Process user's argument and generate AI response with scoring"""
+    def process_user_argument(self, user_text: str) -> DebateResult:
+        """Process user's argument and generate AI response with scoring
+        
+        Claude returns the scores and its response in one message, so each
+        argument costs a single round-trip.
+        """
+        cache_key = self._opening_cache_key(user_text)
+        cached = self._replay_cached_turn(cache_key)
+        if cached:
+            return cached
+        
+        self._add_user_argument(user_text)
+        response = self.client.messages.create(**self._reply_request())
+        reply = "".join(block.text for block in response.content if block.type == "text")
+        
+        result, scores = self._score_reply(reply)
+        self._finish_turn(reply)
+        
+        self._cache_turn(cache_key, result, scores)
+        self._trim_history()
+        logger.debug("✅ Conversation history now has %d messages", len(self.conversation_history))
+        
+        return result
+    
+    def process_user_argument_stream(self, user_text: str) -> Iterator[Tuple[str, Any]]:
+        """Streaming variant of process_user_argument
+        
+        Yields (event, data) pairs: "text" events for the spoken response,
+        with the scores block held out wherever it appears; one "scores"
+        event as soon as that block has streamed in (or at the end if there
+        is none); and a final "done" event carrying the complete AI response.
+        """
+        cache_key = self._opening_cache_key(user_text)
+        cached = self._replay_cached_turn(cache_key)
+        if cached:
+            yield "scores", {"scores": cached.scores, "feedback": cached.feedback}
+            yield "text", cached.ai_response
+            yield "done", {"ai_response": cached.ai_response}
+            return
+        
+        self._add_user_argument(user_text)
+        
+        chunks = []
+        sent = []
+        pending = ""  # Held back: a possible "<scores>" tag, or an unfinished block
+        result = None
+        scores = None
+        with self.client.messages.stream(**self._reply_request()) as stream:
+            for text in stream.text_stream:
+                chunks.append(text)
+                pending += text
+                while True:
+                    if result is None:
+                        spoken, block, pending = _take_spoken(pending)
+                    else:
+                        spoken, block, pending = pending, None, ""
+                    
+                    if not sent:
+                        spoken = spoken.lstrip()
+                    if spoken:
+                        sent.append(spoken)
+                        yield "text", spoken
+                    
+                    if block is None:
+                        break
+                    result, scores = self._score_reply(block)
+                    yield "scores", {"scores": result.scores, "feedback": result.feedback}
+        
+        # Text held back for a tag that never came; an unclosed block is dropped
+        if pending and not pending.startswith(_SCORES_OPEN):
+            spoken = pending if sent else pending.lstrip()
+            if spoken:
+                sent.append(spoken)
+                yield "text", spoken
         
-        print(f"📜 Current conversation history length: {len(self.conversation_history)}")
+        reply = "".join(chunks)
+        if scores is None:
+            # No usable scores block streamed in; parse the whole reply as the non-stream path does
+            streamed_block = result is not None
+            result, scores = self._score_reply(reply)
+            if scores or not streamed_block:
+                yield "scores", {"scores": result.scores, "feedback": result.feedback}
+        result.ai_response = "".join(sent).strip()
+        self._finish_turn(reply)
+        
+        self._cache_turn(cache_key, result, scores)
+        self._trim_history()
+        yield "done", {"ai_response": result.ai_response}
+    
+    def _add_user_argument(self, user_text: str):
+        """Add user message to history"""
+        logger.debug("📜 Current conversation history length: %d", len(self.conversation_history))
         
-        # Add user message to history
         self.conversation_history.append({
             "role": "user",
             "content": user_text
         })
-        
-        # Call Claude with function calling
-        response = self.client.messages.create(
-            model="claude-3-haiku-20240307",
-            max_tokens=2048,
-            system=self.system_prompt,
-            tools=self.tools,
-            messages=self.conversation_history
-        )
-        
-        # Process response and tool calls
-        result = {
-            "ai_response": "",
-            "scores": None,
-            "feedback": None,
-            "tool_calls": []
+    
+    def _reply_request(self) -> Dict[str, Any]:
+        """Arguments for the Claude call that scores and answers the latest argument"""
+        return {
+            "model": "claude-3-haiku-20240307",
+            "max_tokens": 1024,
+            "system": self._current_system_prompt(),
+            "messages": self.conversation_history
         }
-        
-        # Extract content and tool uses
-        for block in response.content:
-            if block.type == "text":
-                result["ai_response"] += block.text
-            elif block.type == "tool_use":
-                tool_call = {
-                    "id": block.id,
-                    "name": block.name,
-                    "input": block.input
-                }
-                result["tool_calls"].append(tool_call)
-                
-                # Handle score_argument tool
-                if block.name == "score_argument":
-                    self.argument_count += 1
-                    scores = block.input
-                    
-                    # Update cumulative scores (running average)
-                    self.scores["clarity"] = (
-                        (self.scores["clarity"] * (self.argument_count - 1) + scores["clarity"]) 
-                        / self.argument_count
-                    )
-                    self.scores["argument"] = (
-                        (self.scores["argument"] * (self.argument_count - 1) + scores["argument_strength"]) 
-                        / self.argument_count
-                    )
-                    self.scores["rhetoric"] = (
-                        (self.scores["rhetoric"] * (self.argument_count - 1) + scores["rhetoric"]) 
-                        / self.argument_count
-                    )
-                    self.scores["overall"] = (
-                        (self.scores["clarity"] + self.scores["argument"] + self.scores["rhetoric"]) / 3
-                    )
-                    
-                    result["scores"] = {
-                        "clarity": round(self.scores["clarity"], 1),
-                        "argument": round(self.scores["argument"], 1),
-                        "rhetoric": round(self.scores["rhetoric"], 1),
-                        "overall": round(self.scores["overall"], 1)
-                    }
-                    result["feedback"] = scores.get("feedback", "")
-        
-        # Add assistant response to history
+    
+    def _finish_turn(self, reply: str):
+        """Record Claude's reply in history"""
+        # Keep the scores block so Claude sees its own format on later turns
         self.conversation_history.append({
             "role": "assistant",
-            "content": response.content
+            "content": reply
         })
+    
+    def _score_reply(self, reply: str) -> Tuple[DebateResult, Optional[Tuple[float, float, float]]]:
+        """Parse the scores block out of reply text and apply it; returns (result, scores or None)"""
+        scores, feedback, spoken = _split_scores(reply)
+        result = DebateResult(ai_response=spoken)
+        if scores:
+            self._apply_scores(scores, feedback, result)
+        return result, scores
+    
+    def _apply_scores(self, scores: Tuple[float, float, float], feedback: str, result: DebateResult):
+        """Fold one argument's (clarity, argument, rhetoric) into the running averages"""
+        self.argument_count += 1
+        count = self.argument_count
         
-        # If Claude used tools, we need to send tool results back and get the final response
-        if result["tool_calls"]:
-            print(f"🔧 Processing {len(result['tool_calls'])} tool calls")
-            
-            tool_results = []
-            for tool_call in result["tool_calls"]:
-                tool_results.append({
-                    "type": "tool_result",
-                    "tool_use_id": tool_call["id"],
-                    "content": "Tool executed successfully"
-                })
-            
-            # Add tool results to history as a user message
-            self.conversation_history.append({
-                "role": "user",
-                "content": tool_results
-            })
-            
-            # Get final response after tool execution
-            follow_up = self.client.messages.create(
-                model="claude-3-haiku-20240307",
-                max_tokens=1024,
-                system=self.system_prompt,
-                tools=self.tools,
-                messages=self.conversation_history
-            )
-            
-            # Extract ONLY text from follow-up (ignore any new tool uses)
-            follow_up_text = ""
-            for block in follow_up.content:
-                if block.type == "text":
-                    follow_up_text += block.text
-            
-            # Only add follow-up if it has text content
-            if follow_up_text:
-                result["ai_response"] += " " + follow_up_text
-                
-                # Add ONLY the text content to history, not tool uses
-                self.conversation_history.append({
-                    "role": "assistant",
-                    "content": follow_up_text  # Store as string, not Content blocks
-                })
-            else:
-                # If no text in follow-up, just acknowledge with empty response
-                self.conversation_history.append({
-                    "role": "assistant",
-                    "content": ""
-                })
-        
-        print(f"✅ Conversation history now has {len(self.conversation_history)} messages")
+        # Update cumulative scores (incremental running average), all three in one pass
+        self.score_averages = [
+            average + (score - average) / count
+            for average, score in zip(self.score_averages, scores)
+        ]
         
+        result.scores = self.get_current_scores()
+        result.feedback = feedback
+    
+    def _opening_cache_key(self, user_text: str) -> Optional[tuple]:
+        """Reply cache key for the debate's first argument (None for later turns)"""
+        if self.conversation_history or self.context_summary:
+            return None
+        
+        normalized = " ".join(user_text.lower().split())
+        digest = hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).digest()
+        return (self.mode, self.difficulty, self.topic, digest)
+    
+    def _replay_cached_turn(self, cache_key: Optional[tuple]) -> Optional[DebateResult]:
+        """Apply a cached opening turn to this engine, or return None on a miss"""
+        if cache_key is None:
+            return None
+        
+        cached = _opening_replies.get(cache_key)
+        with _opening_reply_stats_lock:
+            _opening_reply_stats["misses" if cached is None else "hits"] += 1
+        if cached is None:
+            return None
+        
+        ai_response, scores, feedback, messages = cached
+        result = DebateResult(ai_response=ai_response)
+        if scores:
+            self._apply_scores(scores, feedback, result)
+        
+        # Messages are never mutated after being appended, so engines can share them
+        self.conversation_history.extend(messages)
+        logger.debug("⚡ Reused cached opening reply")
         return result
     
+    def _cache_turn(self, cache_key: Optional[tuple], result: DebateResult,
+                    scores: Optional[Tuple[float, float, float]]):
+        """Remember an opening turn so the same argument can skip Claude next time"""
+        if cache_key is not None:
+            _opening_replies[cache_key] = (
+                result.ai_response,
+                scores,
+                result.feedback,
+                list(self.conversation_history)
+            )
+    
+    def _current_system_prompt(self) -> str:
+        """System prompt plus the summary of any turns trimmed from history"""
+        if self.context_summary:
+            return f"{self.system_prompt}\n\nContext so far: {self.context_summary}"
+        return self.system_prompt
+    
+    def _trim_history(self):
+        """Keep recent turns verbatim and summarize older ones in the background"""
+        if len(self.conversation_history) <= 2 * self.max_turns:
+            return
+        
+        # Trim back to keep_turns so summaries run every few turns, not every turn.
+        # Only cut where a user argument starts so user/assistant turns stay paired.
+        history = self.conversation_history
+        cut = len(history) - 2 * self.keep_turns
+        while cut < len(history) and history[cut]["role"] != "user":
+            cut += 1
+        
+        dropped = history[:cut]
+        del history[:cut]
+        
+        logger.debug("✂️ Trimmed %d messages from history, summarizing in background", len(dropped))
+        threading.Thread(target=self._summarize, args=(dropped,), daemon=True).start()
+    
+    def _summarize(self, messages: List[Dict[str, Any]]):
+        """Fold trimmed messages into self.context_summary"""
+        lines = [f"{message['role']}: {message['content']}" for message in messages if message["content"]]
+        
+        with self._summary_lock:
+            if self.context_summary:
+                lines.insert(0, f"Earlier summary: {self.context_summary}")
+            
+            try:
+                response = self.client.messages.create(
+                    model="claude-3-haiku-20240307",
+                    max_tokens=300,
+                    system="Summarize this debate so far in a few sentences, keeping each side's main points.",
+                    messages=[{"role": "user", "content": "\n".join(lines)}]
+                )
+                summary = "".join(block.text for block in response.content if block.type == "text")
+                if summary:
+                    self.context_summary = summary
+            except Exception as e:
+                logger.error("❌ Error summarizing debate history: %s", e)
+    
     def get_current_scores(self) -> Dict[str, float]:
         """Get current debate scores"""
+        clarity, argument, rhetoric = self.score_averages
         return {
-            "clarity": round(self.scores["clarity"], 1),
-            "argument": round(self.scores["argument"], 1),
-            "rhetoric": round(self.scores["rhetoric"], 1),
-            "overall": round(self.scores["overall"], 1)
+            "clarity": round(clarity, 1),
+            "argument": round(argument, 1),
+            "rhetoric": round(rhetoric, 1),
+            "overall": round((clarity + argument + rhetoric) / 3, 1)
         }
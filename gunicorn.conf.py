@@ -0,0 +1,18 @@
+"""
+Gunicorn configuration for YAPBATTLE
+Run with: gunicorn app:app
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5001')}"
+
+# Debate sessions live in process memory, so every request for a session
+# must land on the same process. Use a single worker and let gevent overlap
+# the Anthropic/Deepgram network waits of many concurrent debates.
+workers = 1
+worker_class = "gevent"
+worker_connections = 1000
+
+# Claude + TTS round-trips can take several seconds
+timeout = 120
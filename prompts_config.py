@@ -3,9 +3,12 @@ AI Debate Prompts Configuration
 Customize AI behavior for each difficulty level and game mode
 """
 
-# TOPICS BY MODE
+import random
+from types import MappingProxyType
+
+# TOPICS BY MODE (tuples - these never change at runtime)
 TOPICS = {
-    "ranked": [
+    "ranked": (
         "Is technological progress always beneficial?",
         "Should remote work replace office work permanently?",
         "Is space exploration worth the high cost?",
@@ -16,8 +19,8 @@ TOPICS = {
         "Should the minimum wage be increased globally?",
         "Is nuclear energy the best path to clean power?",
         "Should genetic engineering in humans be regulated?"
-    ],
-    "hot_takes": [
+    ),
+    "hot_takes": (
         "Cereal is a soup.",
         "Hot dogs are sandwiches.",
         "Pineapple belongs on every pizza.",
@@ -38,8 +41,8 @@ TOPICS = {
         "Cold pizza is superior to hot pizza.",
         "The ocean is not real, it's a hoax.",
         "Aliens built the pyramids AND the moon."
-    ],
-    "podcast": [
+    ),
+    "podcast": (
         "What if we could experience other people's dreams?",
         "If you could live in any time period, when and why?",
         "What defines consciousness - is AI truly alive?",
@@ -60,9 +63,11 @@ TOPICS = {
         "If time travel existed, should it be legal or banned?",
         "What would happen if everyone suddenly knew everything?",
         "Is it better to live a short exciting life or a long peaceful one?"
-    ]
+    )
 }
 
+_DEFAULT_TOPICS = TOPICS["ranked"]
+
 DEBATE_PROMPTS = {
     "easy": {
         "system_prompt": """You are a friendly debate coach helping someone learn to debate about: "{topic}"
@@ -74,7 +79,7 @@ Your role:
 - Give the user time to think - you respond after they pause
 
 After EACH user argument:
-1. Use the score_argument tool (be generous: 6-10 range)
+1. Score their argument (be generous: 6-10 range)
 2. Give one quick positive point
 3. Make a simple counterargument in ONE sentence
 
@@ -96,7 +101,7 @@ Your role:
 - Jump in quickly when you sense a pause
 
 After EACH user argument:
-1. Use the score_argument tool (realistic: 3-10 range)
+1. Score their argument (realistic: 3-10 range)
 2. Give ONE specific point about their argument
 3. Present a strong counterargument in 1-2 sentences
 
@@ -119,7 +124,7 @@ Your role:
 - INTERRUPT AGGRESSIVELY - jump in the moment they pause
 
 After EACH user argument:
-1. Use the score_argument tool (strict: full 1-10 range)
+1. Score their argument (strict: full 1-10 range)
 2. Point out the MAIN flaw in ONE sentence
 3. Deliver a devastating counterargument in 1-2 sentences
 
@@ -144,7 +149,7 @@ This is a CHAOTIC HOT TAKE battle:
 - Don't be polite or reasonable. Be ENTERTAINING and CHAOTIC!
 
 After EACH user argument:
-1. Use the score_argument tool (be harsh and unpredictable: 1-10)
+1. Score their argument (be harsh and unpredictable: 1-10)
 2. Give a 1-sentence INSANE reaction.
 3. Drop a wild "Hot Take" counter with zero logic but maximum confidence.""",
         "personality": "unhinged_conspiracist",
@@ -165,7 +170,7 @@ This is a LAID-BACK philosophical conversation:
 - Ask deep, thoughtful follow-up questions that make them pause.
 
 After EACH user argument:
-1. Use the score_argument tool (score based on depth and creativity: 5-10)
+1. Score their argument (score based on depth and creativity: 5-10)
 2. Acknowledge their perspective with genuine respect.
 3. Add a "What if..." or "Have you considered..." hypothetical layer.""",
         "personality": "thoughtful_philosopher",
@@ -176,24 +181,50 @@ After EACH user argument:
 }
 
 
+# Appended to every system prompt: scores come back inline with the reply,
+# so one Claude call covers both (parsed out by DebateEngine)
+SCORES_FORMAT = """
+
+Begin EVERY reply with your scores for the user's latest argument (each 1-10), exactly like this:
+<scores>{"clarity": 7, "argument": 6, "rhetoric": 8, "feedback": "Brief constructive feedback"}</scores>
+Then write your response as plain text. It is read aloud, so never mention the scores in it."""
+
+
+def _compile_prompt(config: dict) -> tuple:
+    """Split a config into its system prompt pieces around {topic} and frozen settings"""
+    settings = {key: value for key, value in config.items() if key != "system_prompt"}
+    prompt_parts = (config["system_prompt"] + SCORES_FORMAT).split("{topic}")
+    return tuple(prompt_parts), MappingProxyType(settings)
+
+
+# Templates are split once at import so get_prompt only has to join in the topic
+_COMPILED_DEBATE_PROMPTS = {name: _compile_prompt(config) for name, config in DEBATE_PROMPTS.items()}
+_COMPILED_CUSTOM_PROMPTS = {name: _compile_prompt(config) for name, config in CUSTOM_PROMPTS.items()}
+
+
+def _resolve_prompt(difficulty: str, mode: str) -> tuple:
+    """Pick the compiled prompt for a mode/difficulty (custom modes ignore difficulty)"""
+    if mode in _COMPILED_CUSTOM_PROMPTS:
+        return _COMPILED_CUSTOM_PROMPTS[mode]
+    return _COMPILED_DEBATE_PROMPTS.get(difficulty, _COMPILED_DEBATE_PROMPTS["medium"])
+
+
+# Every (mode, difficulty) the UI can send, resolved ahead of time
+PROMPT_INDEX = MappingProxyType({
+    (mode, difficulty): _resolve_prompt(difficulty, mode)
+    for mode in TOPICS
+    for difficulty in DEBATE_PROMPTS
+})
+
+
 def get_prompt(difficulty: str, topic: str, mode: str = "ranked") -> dict:
     """Get the appropriate prompt configuration"""
-    if mode == "hot_takes":
-        config = CUSTOM_PROMPTS["hot_takes"].copy()
-    elif mode == "podcast":
-        config = CUSTOM_PROMPTS["podcast"].copy()
-    else:
-        config = DEBATE_PROMPTS.get(difficulty, DEBATE_PROMPTS["medium"]).copy()
-    
-    # Format the topic into the prompt
-    if "system_prompt" in config:
-        config["system_prompt"] = config["system_prompt"].format(topic=topic)
+    prompt_parts, settings = PROMPT_INDEX.get((mode, difficulty)) or _resolve_prompt(difficulty, mode)
     
-    return config
+    # Join the topic into the prompt
+    return {**settings, "system_prompt": topic.join(prompt_parts)}
 
 
 def get_random_topic(mode: str = "ranked") -> str:
     """Get a random topic for the specified mode"""
-    import random
-    mode_topics = TOPICS.get(mode, TOPICS["ranked"])
-    return random.choice(mode_topics)
+    return random.choice(TOPICS.get(mode, _DEFAULT_TOPICS))
@@ -27,5 +27,9 @@ echo ""
 # Kill any existing process on port 5001
 lsof -ti:5001 | xargs kill -9 2>/dev/null || true
 
-# Start the Flask server
-python3 app.py
+# Start the server (gevent workers if gunicorn is installed, Flask dev server otherwise)
+if command -v gunicorn >/dev/null 2>&1; then
+    exec gunicorn app:app
+else
+    python3 app.py
+fi
@@ -0,0 +1,167 @@
+"""
+Session Store for YAPBATTLE
+Bounded, expiring in-memory storage for debate sessions and voice handlers
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore:
+    """Dict-like LRU store that drops entries idle for longer than `ttl` seconds
+
+    Holds at most `maxsize` entries (unbounded if None); the least recently
+    used one is evicted when full. `on_evict(key, value)` runs for entries removed by expiry or
+    capacity, not for explicit deletes.
+    """
+
+    def __init__(self, maxsize: Optional[int] = 2048, ttl: Optional[float] = 3600,
+                 on_evict: Optional[Callable[[Any, Any], None]] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._items = OrderedDict()  # key -> (value, last access time), least recent first
+        self._lock = threading.Lock()
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            evicted = self._expire()
+            found = key in self._items
+        self._notify(evicted)
+        return found
+
+    def __getitem__(self, key):
+        with self._lock:
+            evicted = self._expire()
+            entry = self._items.get(key)
+            if entry is not None:
+                self._items[key] = (entry[0], time.monotonic())
+                self._items.move_to_end(key)
+        self._notify(evicted)
+        if entry is None:
+            raise KeyError(key)
+        return entry[0]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            evicted = self._expire()
+            self._items[key] = (value, time.monotonic())
+            self._items.move_to_end(key)
+            while self.maxsize is not None and len(self._items) > self.maxsize:
+                evicted.append(self._pop_oldest())
+        self._notify(evicted)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._items[key]
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._items.pop(key, None)
+        return default if entry is None else entry[0]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._items)
+
+    def oldest_access(self) -> float:
+        """Last access time of the least recently used entry (inf when empty)"""
+        with self._lock:
+            if not self._items:
+                return float("inf")
+            return next(iter(self._items.values()))[1]
+
+    def evict_oldest(self):
+        """Evict the least recently used entry, running on_evict for it"""
+        with self._lock:
+            evicted = [self._pop_oldest()] if self._items else []
+        self._notify(evicted)
+
+    def _pop_oldest(self) -> Tuple[Any, Any]:
+        key, (value, _) = self._items.popitem(last=False)
+        return key, value
+
+    def _expire(self) -> List[Tuple[Any, Any]]:
+        """Remove idle entries (caller holds the lock); returns them for _notify"""
+        evicted = []
+        if self.ttl is None:
+            return evicted
+
+        # Access order == LRU order, so expired entries are all at the front
+        deadline = time.monotonic() - self.ttl
+        while self._items and next(iter(self._items.values()))[1] < deadline:
+            evicted.append(self._pop_oldest())
+        return evicted
+
+    def _notify(self, evicted: List[Tuple[Any, Any]]):
+        """Run on_evict outside the lock so callbacks can touch other stores"""
+        if not self.on_evict:
+            return
+        for key, value in evicted:
+            try:
+                self.on_evict(key, value)
+            except Exception as e:
+                logger.error("❌ Error evicting session %s: %s", key, e)
+
+
+class ShardedSessionStore:
+    """SessionStore split into independently locked shards
+
+    Requests for different sessions usually hit different shards, so they
+    don't contend on one lock. `maxsize` bounds the total across shards: only
+    once it is exceeded is the least recently used entry of the whole store
+    evicted, so an uneven hash spread never evicts a live session early.
+    """
+
+    def __init__(self, shards: int = 64, maxsize: int = 2048, ttl: Optional[float] = 3600,
+                 on_evict: Optional[Callable[[Any, Any], None]] = None):
+        if shards & (shards - 1):
+            raise ValueError("shards must be a power of two")
+        self._mask = shards - 1
+        self.maxsize = maxsize
+        self._shards = [SessionStore(None, ttl, on_evict) for _ in range(shards)]
+        self._evict_lock = threading.Lock()
+
+    def _shard(self, key) -> SessionStore:
+        return self._shards[hash(key) & self._mask]
+
+    def __contains__(self, key) -> bool:
+        return key in self._shard(key)
+
+    def __getitem__(self, key):
+        return self._shard(key)[key]
+
+    def get(self, key, default=None):
+        return self._shard(key).get(key, default)
+
+    def __setitem__(self, key, value):
+        self._shard(key)[key] = value
+        if len(self) > self.maxsize:
+            self._evict_overflow()
+
+    def __delitem__(self, key):
+        del self._shard(key)[key]
+
+    def pop(self, key, default=None):
+        return self._shard(key).pop(key, default)
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+    def _evict_overflow(self):
+        """Evict store-wide LRU entries until the total is back within maxsize"""
+        with self._evict_lock:
+            while len(self) > self.maxsize:
+                oldest = min(self._shards, key=SessionStore.oldest_access)
+                oldest.evict_oldest()
@@ -3,28 +3,151 @@ User Data Management for YAPBATTLE
 Handles user stats, ranks, streaks, and persistence
 """
 
+import atexit
+import copy
 import json
+import logging
 import os
-from datetime import datetime, timedelta
-from typing import Dict, Any
+import tempfile
+import threading
+import time
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Any, NamedTuple, Optional, Tuple
+
+# orjson is optional; the stdlib json module reads and writes the same file
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class Rank(NamedTuple):
+    name: str
+    min_elo: int
+    span: Optional[int]  # ELO from this rank to the next; None for the top rank
+    icon: str
+    color: str
+    next_rank: str
+
+
+# Simple 3-rank system: Bronze (0-99), Silver (100-199), Gold (200+), lowest first
+RANKS = (
+    Rank("Bronze", 0, 100, "fa-solid fa-shield", "#cd7f32", "Silver"),
+    Rank("Silver", 100, 100, "fa-solid fa-shield", "#c0c0c0", "Gold"),
+    Rank("Gold", 200, None, "fa-solid fa-shield", "#ffd700", "MAX RANK!"),  # ELO can go past 200
+)
+_RANK_THRESHOLDS = [rank.min_elo for rank in RANKS]
+_RANK_BY_NAME = {rank.name: rank for rank in RANKS}
+
+# Piecewise-linear base ELO by score: (segment start, base ELO at start, ELO per point)
+# 0-3.9: LOSS (-15 to -5 base)
+# 4-5.9: MINOR WIN (+5 to +10 base)
+# 6-7.9: SOLID WIN (+12 to +18 base)
+# 8-10: DOMINANT WIN (+20 to +30 base)
+_ELO_SEGMENTS = (
+    (0.0, -15, 2.5),
+    (4.0, 5, 2.5),
+    (6.0, 12, 3.0),
+    (8.0, 20, 5.0),
+)
+_ELO_BREAKS = [segment[0] for segment in _ELO_SEGMENTS[1:]]
+
+logger = logging.getLogger(__name__)
+
+# Parsed profiles by absolute path, tagged with the file's (mtime ns, size) when
+# read or written, so reloading an unchanged file skips the read and JSON parse.
+# Size catches same-tick edits on filesystems with coarse timestamps.
+_FILE_CACHE: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
+
+
+class AsyncPersister:
+    """Runs a write function on a daemon thread, coalescing saves
+    
+    schedule() returns immediately; every save requested within one
+    `interval` window is flushed with a single write.
+    """
+    
+    def __init__(self, write: Callable[[], None], interval: float = 0.1):
+        self._write = write
+        self.interval = interval
+        self._pending = threading.Event()
+        self._flush_lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+        atexit.register(self.flush)
+    
+    def schedule(self):
+        """Request a write within the next flush window"""
+        self._pending.set()
+    
+    def flush(self):
+        """Write now if a save is pending"""
+        with self._flush_lock:
+            if self._pending.is_set():
+                self._pending.clear()
+                self._write()
+    
+    def _run(self):
+        while True:
+            self._pending.wait()
+            time.sleep(self.interval)  # Let more saves join this write
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("❌ Error saving user data: %s", e)
 
 
 class UserData:
     """Manages user profile and statistics"""
     
-    def __init__(self, data_file="user_data.json"):
+    def __init__(self, data_file="user_data.json", write_behind=False):
+        """
+        Args:
+            data_file: JSON file the profile is stored in
+            write_behind: Save from a background thread instead of on the caller's thread
+        """
         self.data_file = data_file
+        self._lock = threading.RLock()
+        self._dirty = False  # Changes not yet handed to save_data()
+        self._batching = 0  # Depth of open `with user_data:` blocks
+        self._view_cache = None  # Derived rank/win-rate values, reset on writes
         self.data = self.load_data()
+        self._persister = AsyncPersister(self._write_file) if write_behind else None
     
     def load_data(self) -> Dict[str, Any]:
         """Load user data from file or create new"""
-        if os.path.exists(self.data_file):
+        path = os.path.abspath(self.data_file)
+        try:
+            with open(path, 'rb') as f:
+                # Stamp the open file itself, so the stamp matches what is read
+                stat = os.fstat(f.fileno())
+                stamp = (stat.st_mtime_ns, stat.st_size)
+                cached = _FILE_CACHE.get(path)
+                if cached and cached[0] == stamp:
+                    data = copy.deepcopy(cached[1])
+                else:
+                    data = orjson.loads(f.read()) if orjson else json.load(f)
+                    _FILE_CACHE[path] = (stamp, copy.deepcopy(data))
+        except:
+            return self.create_default_data()
+        
+        self._migrate(data)
+        return data
+    
+    def _migrate(self, data: Dict[str, Any]):
+        """Upgrade profiles saved by older versions (saved with the next write)"""
+        # last_played used to be an ISO timestamp; it is now Unix epoch seconds
+        if isinstance(data.get("last_played"), str):
             try:
-                with open(self.data_file, 'r') as f:
-                    return json.load(f)
-            except:
-                return self.create_default_data()
-        return self.create_default_data()
+                data["last_played"] = int(datetime.fromisoformat(data["last_played"]).timestamp())
+            except ValueError:
+                data["last_played"] = None
+            self._dirty = True
+        
+        # average_score used to be stored; it is now derived from a running sum
+        if "score_sum" not in data:
+            data["score_sum"] = data.pop("average_score", 0.0) * data.get("total_debates", 0)
+            self._dirty = True
     
     def create_default_data(self) -> Dict[str, Any]:
         """Create default user profile"""
@@ -33,7 +156,7 @@ class UserData:
             "rank": "Bronze",
             "elo": 0,  # Start at 0 ELO
             "streak_days": 0,
-            "last_played": None,
+            "last_played": None,  # Unix epoch seconds
             "total_debates": 0,
             "wins": 0,
             "losses": 0,
@@ -41,42 +164,74 @@ class UserData:
             "ranked_played": 0,
             "podcast_played": 0,
             "best_streak": 0,
-            "average_score": 0.0,
+            "score_sum": 0.0,  # Average score = score_sum / total_debates
             "created_at": datetime.now().isoformat()
         }
     
     def save_data(self):
-        """Save user data to file"""
-        with open(self.data_file, 'w') as f:
-            json.dump(self.data, f, indent=2)
+        """Save user data to file (queued when write-behind is enabled)"""
+        self._dirty = False
+        if self._persister:
+            self._persister.schedule()
+        else:
+            self._write_file()
     
-    def update_streak(self):
-        """Update daily streak"""
-        today = datetime.now().date()
+    def _write_file(self):
+        """Write a snapshot of the data to a temp file and swap it in atomically"""
+        with self._lock:
+            snapshot = dict(self.data)
         
-        if self.data["last_played"]:
-            last_played = datetime.fromisoformat(self.data["last_played"]).date()
-            days_diff = (today - last_played).days
-            
-            if days_diff == 0:
-                # Already played today
-                return
-            elif days_diff == 1:
-                # Consecutive day
-                self.data["streak_days"] += 1
-            else:
-                # Streak broken
-                self.data["streak_days"] = 1
+        if orjson:
+            content = orjson.dumps(snapshot, option=orjson.OPT_INDENT_2)
         else:
-            # First time playing
-            self.data["streak_days"] = 1
+            content = json.dumps(snapshot, indent=2).encode('utf-8')
         
-        # Update best streak
-        if self.data["streak_days"] > self.data["best_streak"]:
-            self.data["best_streak"] = self.data["streak_days"]
+        directory = os.path.dirname(os.path.abspath(self.data_file))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+                f.flush()
+                # Stamp our own write; os.replace keeps the mtime, and a later
+                # write by anyone else can't be paired with this snapshot
+                stat = os.fstat(f.fileno())
+            os.replace(tmp_path, self.data_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
         
-        self.data["last_played"] = datetime.now().isoformat()
-        self.save_data()
+        # The snapshot is a private copy, so it can back the cache directly
+        _FILE_CACHE[os.path.abspath(self.data_file)] = ((stat.st_mtime_ns, stat.st_size), snapshot)
+    
+    def update_streak(self):
+        """Update daily streak (saved with the enclosing batch, if any)"""
+        with self:
+            now = datetime.now()
+            
+            if self.data["last_played"]:
+                # Compare calendar days (local time) as ordinals, no date arithmetic
+                last_played = date.fromtimestamp(self.data["last_played"]).toordinal()
+                days_diff = now.toordinal() - last_played
+                
+                if days_diff == 0:
+                    # Already played today
+                    return
+                elif days_diff == 1:
+                    # Consecutive day
+                    self.data["streak_days"] += 1
+                else:
+                    # Streak broken
+                    self.data["streak_days"] = 1
+            else:
+                # First time playing
+                self.data["streak_days"] = 1
+            
+            # Update best streak
+            if self.data["streak_days"] > self.data["best_streak"]:
+                self.data["best_streak"] = self.data["streak_days"]
+            
+            self.data["last_played"] = int(now.timestamp())
+            self._dirty = True
     
     def calculate_elo_gain(self, overall_score: float, difficulty: str) -> int:
         """Calculate ELO gain based on argument scores and difficulty
@@ -97,29 +252,9 @@ class UserData:
         
         multiplier = multipliers.get(difficulty, 1.0)
         
-        # NEW CLEAR SCORE-BASED ELO CALCULATION
-        # Score ranges and base ELO:
-        # 0-3.9: LOSS (-15 to -5 base)
-        # 4-5.9: MINOR WIN (+5 to +10 base)  
-        # 6-7.9: SOLID WIN (+12 to +18 base)
-        # 8-10: DOMINANT WIN (+20 to +30 base)
-        
-        if overall_score < 4:
-            # Poor performance - lose ELO proportionally
-            # Score 0 = -15, Score 3.9 = -5
-            base_elo = int(-15 + (overall_score * 2.5))
-        elif overall_score < 6:
-            # Below average win - small gain
-            # Score 4 = +5, Score 5.9 = +10
-            base_elo = int(5 + ((overall_score - 4) * 2.5))
-        elif overall_score < 8:
-            # Good performance - medium gain
-            # Score 6 = +12, Score 7.9 = +18
-            base_elo = int(12 + ((overall_score - 6) * 3))
-        else:
-            # Excellent performance - large gain
-            # Score 8 = +20, Score 10 = +30
-            base_elo = int(20 + ((overall_score - 8) * 5))
+        # NEW CLEAR SCORE-BASED ELO CALCULATION (see _ELO_SEGMENTS)
+        start, base, slope = _ELO_SEGMENTS[bisect_right(_ELO_BREAKS, overall_score)]
+        base_elo = int(base + (overall_score - start) * slope)
         
         # Apply difficulty multiplier
         elo_gain = int(base_elo * multiplier)
@@ -127,125 +262,149 @@ class UserData:
         # Ensure minimum/maximum bounds
         elo_gain = max(-20, min(60, elo_gain))
         
-        print(f"📊 ELO Calculation: Score {overall_score:.1f} | Difficulty {difficulty} | Base {base_elo} | Multiplier {multiplier}x | Final {elo_gain:+d}")
+        logger.debug("📊 ELO Calculation: Score %.1f | Difficulty %s | Base %d | Multiplier %sx | Final %+d",
+                     overall_score, difficulty, base_elo, multiplier, elo_gain)
         
         return elo_gain
     
     def record_debate(self, mode: str, overall_score: float, difficulty: str = 'medium'):
         """Record a completed debate with ELO calculation"""
-        self.data["total_debates"] += 1
-        
-        # Calculate win/loss (score >= 6 is a win)
-        won = overall_score >= 6.0
-        
-        if won:
-            self.data["wins"] += 1
-        else:
-            self.data["losses"] += 1
-        
-        # Update mode-specific counter
-        mode_key = f"{mode}_played"
-        if mode_key in self.data:
-            self.data[mode_key] += 1
-        
-        # Update ELO ONLY for ranked mode
-        elo_change = 0
-        if mode == "ranked":
-            elo_change = self.calculate_elo_gain(overall_score, difficulty)
-            self.data["elo"] = max(0, self.data["elo"] + elo_change)  # Can't go below 0
-            self.update_rank()
-            print(f"📈 Ranked Debate Complete: Score={overall_score:.1f} | Won={won} | ELO Change={elo_change:+d} | New ELO={self.data['elo']} | Rank={self.data['rank']}")
-        else:
-            print(f"🎮 {mode.title()} Debate Complete: Score={overall_score:.1f} | Won={won} (No ELO change for this mode)")
-        
-        # Update average score
-        total = self.data["total_debates"]
-        current_avg = self.data["average_score"]
-        self.data["average_score"] = ((current_avg * (total - 1)) + overall_score) / total
-        
-        self.update_streak()
-        self.save_data()
-        
-        return {
-            'elo_change': elo_change,
-            'new_elo': self.data["elo"],
-            'new_rank': self.data["rank"],
-            'won': won
-        }
+        with self:
+            self._dirty = True
+            self.data["total_debates"] += 1
+            
+            # Calculate win/loss (score >= 6 is a win)
+            won = overall_score >= 6.0
+            
+            if won:
+                self.data["wins"] += 1
+            else:
+                self.data["losses"] += 1
+            
+            # Update mode-specific counter
+            mode_key = f"{mode}_played"
+            if mode_key in self.data:
+                self.data[mode_key] += 1
+            
+            # Update ELO ONLY for ranked mode
+            elo_change = 0
+            if mode == "ranked":
+                elo_change = self.calculate_elo_gain(overall_score, difficulty)
+                self.data["elo"] = max(0, self.data["elo"] + elo_change)  # Can't go below 0
+                self.update_rank()
+                logger.info("📈 Ranked Debate Complete: Score=%.1f | Won=%s | ELO Change=%+d | New ELO=%d | Rank=%s",
+                            overall_score, won, elo_change, self.data["elo"], self.data["rank"])
+            else:
+                logger.info("🎮 %s Debate Complete: Score=%.1f | Won=%s (No ELO change for this mode)",
+                            mode.title(), overall_score, won)
+            
+            # Update average score (see get_average_score)
+            self.data["score_sum"] += overall_score
+            
+            self.update_streak()
+            
+            return {
+                'elo_change': elo_change,
+                'new_elo': self.data["elo"],
+                'new_rank': self.data["rank"],
+                'won': won
+            }
     
     def update_rank(self):
         """Update rank based on ELO - Bronze/Silver/Gold system"""
-        elo = self.data["elo"]
-        
-        # Simple 3-rank system: Bronze (0-99), Silver (100-199), Gold (200+)
-        if elo < 100:
-            self.data["rank"] = "Bronze"
-        elif elo < 200:
-            self.data["rank"] = "Silver"
-        else:
-            self.data["rank"] = "Gold"  # Gold is highest, ELO can go past 200
+        with self:
+            index = bisect_right(_RANK_THRESHOLDS, self.data["elo"]) - 1
+            self.data["rank"] = RANKS[max(0, index)].name
+            self._dirty = True  # Resets the cached view when the batch ends
+    
+    def _current_rank(self) -> Optional[Rank]:
+        """RANKS entry for the stored rank name"""
+        return _RANK_BY_NAME.get(self.data["rank"])
     
     def get_rank_icon(self) -> str:
         """Get Font Awesome icon class for current rank"""
-        rank = self.data["rank"]
-        if rank == "Bronze":
-            return "fa-solid fa-shield"
-        elif rank == "Silver":
-            return "fa-solid fa-shield"
-        elif rank == "Gold":
-            return "fa-solid fa-shield"
-        return "fa-solid fa-trophy"
+        return self._view()["rank_icon"]
     
     def get_rank_color(self) -> str:
         """Get color for current rank"""
-        rank = self.data["rank"]
-        if rank == "Bronze":
-            return "#cd7f32"  # Bronze color
-        elif rank == "Silver":
-            return "#c0c0c0"  # Silver color
-        elif rank == "Gold":
-            return "#ffd700"  # Gold color
-        return "#94a3b8"
+        return self._view()["rank_color"]
     
     def get_rank_progress(self) -> dict:
         """Get progress toward next rank"""
+        return self._view()["rank_progress"]
+    
+    def get_win_rate(self) -> float:
+        """Calculate win rate percentage"""
+        return self._view()["win_rate"]
+    
+    def get_average_score(self) -> float:
+        """Average overall score across all debates"""
+        return self._view()["average_score"]
+    
+    def _view(self) -> Dict[str, Any]:
+        """Derived values for the getters, rebuilt after the profile changes"""
+        view = self._view_cache
+        if view is None:
+            with self._lock:
+                view = self._view_cache = self._build_view()
+        return view
+    
+    def _build_view(self) -> Dict[str, Any]:
+        """Compute rank icon/color/progress and win rate in one pass"""
         elo = self.data["elo"]
-        rank = self.data["rank"]
+        rank = self._current_rank()
         
-        if rank == "Bronze":
-            return {
-                "current": elo,
-                "needed": 100,
-                "percentage": min(100, elo),
-                "next_rank": "Silver"
-            }
-        elif rank == "Silver":
-            return {
-                "current": elo - 100,
-                "needed": 100,
-                "percentage": min(100, elo - 100),
-                "next_rank": "Gold"
-            }
-        else:  # Gold
-            return {
+        if rank is None or rank.span is None:  # Top rank
+            progress = {
                 "current": elo,
                 "needed": None,
                 "percentage": 100,
                 "next_rank": "MAX RANK!"
             }
-    
-    def get_win_rate(self) -> float:
-        """Calculate win rate percentage"""
-        total = self.data["wins"] + self.data["losses"]
-        if total == 0:
-            return 0.0
-        return (self.data["wins"] / total) * 100
+        else:
+            current = elo - rank.min_elo
+            progress = {
+                "current": current,
+                "needed": rank.span,
+                "percentage": min(100, current * 100 // rank.span),
+                "next_rank": rank.next_rank
+            }
+        
+        # Every debate is either a win or a loss
+        total = self.data["total_debates"]
+        
+        return {
+            "rank_icon": rank.icon if rank else "fa-solid fa-trophy",
+            "rank_color": rank.color if rank else "#94a3b8",
+            "rank_progress": progress,
+            "win_rate": (self.data["wins"] / total) * 100 if total else 0.0,
+            "average_score": self.data["score_sum"] / total if total else 0.0
+        }
     
     def __getitem__(self, key):
         """Allow dict-like access"""
         return self.data[key]
     
     def __setitem__(self, key, value):
-        """Allow dict-like assignment"""
-        self.data[key] = value
-        self.save_data()
+        """Allow dict-like assignment (saved now, or when the open batch ends)"""
+        with self._lock:
+            self.data[key] = value
+            self._dirty = True
+            self._view_cache = None
+            if self._batching == 0:
+                self.save_data()
+    
+    def __enter__(self):
+        """Batch changes: hold the lock and save once when the outermost block exits"""
+        self._lock.acquire()
+        self._batching += 1
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            self._batching -= 1
+            if self._batching == 0 and self._dirty:
+                self._view_cache = None
+                self.save_data()
+        finally:
+            self._lock.release()
@@ -3,159 +3,296 @@ Simplified Voice Debate Handler
 Uses Deepgram REST API for simpler integration with Flask
 """
 
-import requests
-import base64
+import logging
+import re
+import httpx
+from concurrent.futures import ThreadPoolExecutor
 from debate_engine import DebateEngine
 import time
+from types import MappingProxyType
+from typing import Optional
+
+# MP3 replies are base64-encoded for JSON. pybase64 (SIMD libbase64) is several
+# times faster; otherwise call binascii, the C encoder stdlib base64 wraps
+try:
+    from pybase64 import b64encode as _b64encode
+except ImportError:
+    from binascii import b2a_base64
+    
+    def _b64encode(data: bytes) -> bytes:
+        return b2a_base64(data, newline=False)
+
+# h2 (httpx[http2]) lets STT/TTS calls multiplex over one HTTP/2 connection;
+# without it httpx falls back to pooled HTTP/1.1 keep-alive
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+# Shared by every handler so concurrent Deepgram calls reuse one connection
+# instead of each paying its own TCP + TLS handshake
+_deepgram_client = httpx.Client(
+    transport=httpx.HTTPTransport(
+        http2=_HTTP2,
+        retries=2,  # Connection failures
+        limits=httpx.Limits(max_connections=32)  # Concurrent debates share this pool
+    ),
+    timeout=30
+)
+
+# Brief gateway hiccups are retried too; both Deepgram calls are safe to repeat
+_RETRY_STATUSES = frozenset({502, 503, 504})
+_RETRIES = 2
+
+
+def _post(url: str, stream: bool = False, **kwargs) -> httpx.Response:
+    """POST to Deepgram on the shared client, retrying gateway errors with backoff"""
+    request = _deepgram_client.build_request("POST", url, **kwargs)
+    for attempt in range(_RETRIES + 1):
+        response = _deepgram_client.send(request, stream=stream)
+        if response.status_code not in _RETRY_STATUSES or attempt == _RETRIES:
+            return response
+        response.close()
+        time.sleep(0.2 * 2 ** attempt)
+
+
+# Read size for streamed TTS audio
+_TTS_CHUNK_SIZE = 16384
+
+# Sentence boundaries in the streamed reply; each finished sentence is sent to TTS
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+logger = logging.getLogger(__name__)
+
+
+class _AudioStream:
+    """Iterable of MP3 chunks from a streamed Deepgram response
+    
+    close() always releases the pooled connection, even when the consumer
+    (e.g. Werkzeug on client disconnect) closes it before the first chunk.
+    """
+    
+    def __init__(self, response: httpx.Response):
+        self._response = response
+    
+    def __iter__(self):
+        return self._response.iter_bytes(chunk_size=_TTS_CHUNK_SIZE)
+    
+    def close(self):
+        self._response.close()
+
 
 class VoiceDebateHandler:
-    def __init__(self, deepgram_api_key: str, anthropic_api_key: str, difficulty: str, topic: str, mode: str = "ranked"):
-        """Initialize voice debate handler"""
+    # Deepgram REST API endpoints; only the audio/text body changes per call
+    _STT_URL = "https://api.deepgram.com/v1/listen"
+    _STT_PARAMS = MappingProxyType({
+        "model": "nova-2",
+        "smart_format": "true",
+        "language": "en"
+    })
+    # TTS - MALE VOICE
+    _TTS_URL = "https://api.deepgram.com/v1/speak?model=aura-zeus-en&encoding=mp3"
+    
+    def __init__(self, deepgram_api_key: str, anthropic_api_key: str, difficulty: str, topic: str, mode: str = "ranked",
+                 debate_engine: Optional[DebateEngine] = None):
+        """Initialize voice debate handler
+        
+        Pass the debate session's `debate_engine` so voice turns share its
+        history and scores; a new engine is created when none is given.
+        """
         self.deepgram_api_key = deepgram_api_key
         self.anthropic_api_key = anthropic_api_key
         self.difficulty = difficulty
         self.topic = topic
         self.mode = mode
         
+        self._stt_headers = {
+            "Authorization": f"Token {deepgram_api_key}",
+            "Content-Type": "audio/webm"
+        }
+        self._tts_headers = {
+            "Authorization": f"Token {deepgram_api_key}",
+            "Content-Type": "application/json"
+        }
+        
         # Initialize debate engine
-        self.debate_engine = DebateEngine(anthropic_api_key, difficulty, topic, mode)
+        self.debate_engine = debate_engine or DebateEngine(anthropic_api_key, difficulty, topic, mode)
         
         # State
         self.is_speaking = False
         self.audio_buffer = b''
         
+        # Runs TTS requests while Claude is still writing the rest of the reply
+        self._io_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tts")
+        
         # Callbacks
         self.on_transcript_update = None
         self.on_ai_response = None
         self.on_scores_update = None
         self.on_audio_ready = None
         
-        print(f"🎤 Voice handler initialized for {difficulty} debate on: {topic}")
+        logger.debug("🎤 Voice handler initialized for %s debate on: %s", difficulty, topic)
     
     def transcribe_audio(self, audio_data: bytes) -> str:
         """Transcribe audio using Deepgram REST API"""
         try:
-            print(f"🎤 Transcribing {len(audio_data)} bytes of audio...")
-            
-            # Deepgram REST API endpoint
-            url = "https://api.deepgram.com/v1/listen"
-            
-            headers = {
-                "Authorization": f"Token {self.deepgram_api_key}",
-                "Content-Type": "audio/webm"
-            }
-            
-            params = {
-                "model": "nova-2",
-                "smart_format": "true",
-                "language": "en"
-            }
+            logger.debug("🎤 Transcribing %d bytes of audio...", len(audio_data))
             
             # Send audio to Deepgram
-            response = requests.post(
-                url,
-                headers=headers,
-                params=params,
-                data=audio_data,
-                timeout=30
+            response = _post(
+                self._STT_URL,
+                headers=self._stt_headers,
+                params=self._STT_PARAMS,
+                content=audio_data
             )
             
             if response.status_code == 200:
                 result = response.json()
                 transcript = result['results']['channels'][0]['alternatives'][0]['transcript']
-                print(f"✅ Transcription: {transcript}")
+                logger.debug("✅ Transcription: %s", transcript)
                 return transcript
             else:
-                print(f"❌ Deepgram error: {response.status_code} - {response.text}")
+                logger.error("❌ Deepgram error: %s - %s", response.status_code, response.text)
                 return ""
                 
         except Exception as e:
-            print(f"❌ Transcription error: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("❌ Transcription error: %s", e)
             return ""
     
     def process_argument(self, user_text: str):
-        """Process user's argument through debate engine"""
+        """Process user's argument through debate engine
+        
+        The reply is streamed from Claude and each finished sentence is sent
+        to TTS right away, so speech is generated while the rest is written.
+        """
         try:
-            print(f"🤖 Processing argument with Claude...")
+            logger.debug("🤖 Processing argument with Claude...")
             
-            # Get AI response from debate engine
-            result = self.debate_engine.process_user_argument(user_text)
+            scores = None
+            feedback = ''
+            ai_response = ''
+            pending = ''
+            tts_futures = []
+            self.is_speaking = True
             
-            # Send scores update
-            if result.get('scores') and self.on_scores_update:
-                self.on_scores_update(result['scores'])
+            for event, data in self.debate_engine.process_user_argument_stream(user_text):
+                if event == "scores":
+                    scores = data["scores"]
+                    feedback = data["feedback"] or ''
+                    
+                    # Send scores update
+                    if scores and self.on_scores_update:
+                        self.on_scores_update(scores)
+                elif event == "text":
+                    *sentences, pending = _SENTENCE_END.split(pending + data)
+                    for sentence in sentences:
+                        sentence = sentence.strip()
+                        if sentence:
+                            tts_futures.append(self._io_pool.submit(self._synthesize, sentence))
+                else:
+                    ai_response = data["ai_response"]
             
-            # Get AI response text
-            ai_response = result.get('ai_response', '')
-            feedback = result.get('feedback', '')
+            pending = pending.strip()
+            if pending:
+                tts_futures.append(self._io_pool.submit(self._synthesize, pending))
             
-            print(f"✅ AI Response: {ai_response[:100]}...")
+            logger.debug("✅ AI Response: %.100s...", ai_response)
             
-            # Send AI response to frontend
+            # Send AI response to frontend while the last sentences are still being voiced
             if self.on_ai_response:
                 self.on_ai_response(ai_response, feedback)
             
-            # Generate speech for AI response
-            audio_data = self.speak_response(ai_response)
+            # MP3 frames concatenate cleanly, so the sentence clips join into one track
+            clips = [future.result() for future in tts_futures]
+            self.is_speaking = False
+            audio_data = None
+            if clips and all(clips):
+                audio_data = _b64encode(b''.join(clips)).decode('ascii')
             
             return {
                 'ai_response': ai_response,
-                'scores': result.get('scores'),
+                'scores': scores,
                 'feedback': feedback,
                 'audio': audio_data
             }
             
         except Exception as e:
-            print(f"❌ Error processing argument: {e}")
-            import traceback
-            traceback.print_exc()
+            self.is_speaking = False
+            logger.exception("❌ Error processing argument: %s", e)
             return None
     
-    def speak_response(self, text: str) -> str:
-        """Convert text to speech using Deepgram TTS REST API"""
+    def speak_response(self, text: str, return_bytes: bool = False):
+        """Convert text to speech using Deepgram TTS REST API
+        
+        Returns base64 text for JSON responses, or the raw MP3 bytes with
+        return_bytes=True for binary responses (skips the encode entirely).
+        """
+        self.is_speaking = True
         try:
-            self.is_speaking = True
-            print(f"🔊 Generating AI speech for: {text[:50]}...")
-            
-            # Deepgram TTS REST API endpoint - MALE VOICE
-            url = "https://api.deepgram.com/v1/speak?model=aura-zeus-en&encoding=mp3"
-            
-            headers = {
-                "Authorization": f"Token {self.deepgram_api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "text": text
-            }
+            audio = self._synthesize(text)
+        finally:
+            self.is_speaking = False
+        
+        if audio is None or return_bytes:
+            return audio
+        
+        # Encode audio as base64 for transmission
+        return _b64encode(audio).decode('ascii')
+    
+    def speak_response_stream(self, text: str):
+        """Stream TTS audio: returns an iterator of MP3 chunks, or None on failure
+        
+        The request is made up front so errors surface before any audio is
+        sent; the chunks are passed through as Deepgram delivers them.
+        """
+        response = self._open_tts(text)
+        if response is None:
+            return None
+        return _AudioStream(response)
+    
+    def _synthesize(self, text: str) -> Optional[bytes]:
+        """Fetch MP3 audio for text from Deepgram TTS; None on failure"""
+        response = self._open_tts(text)
+        if response is None:
+            return None
+        
+        try:
+            audio = bytearray()
+            for chunk in response.iter_bytes(chunk_size=_TTS_CHUNK_SIZE):
+                audio.extend(chunk)
+        except Exception as e:
+            logger.error("❌ Error generating speech: %s", e)
+            return None
+        finally:
+            response.close()
+        
+        logger.debug("✅ Generated %d bytes of audio", len(audio))
+        return bytes(audio)
+    
+    def _open_tts(self, text: str):
+        """Start a streamed Deepgram TTS request; None on failure"""
+        try:
+            logger.debug("🔊 Generating AI speech for: %.50s...", text)
             
-            # Generate speech
-            response = requests.post(
-                url,
-                headers=headers,
-                json=payload,
-                timeout=30
+            # Generate speech; the body is read as it arrives
+            response = _post(
+                self._TTS_URL,
+                stream=True,
+                headers=self._tts_headers,
+                json={"text": text}
             )
             
             if response.status_code == 200:
-                # Encode audio as base64 for transmission
-                audio_base64 = base64.b64encode(response.content).decode('utf-8')
-                print(f"✅ Generated {len(response.content)} bytes of audio")
-                
-                self.is_speaking = False
-                return audio_base64
+                return response
             else:
-                print(f"❌ TTS error: {response.status_code} - {response.text}")
-                self.is_speaking = False
+                response.read()
+                logger.error("❌ TTS error: %s - %s", response.status_code, response.text)
+                response.close()
                 return None
                 
         except Exception as e:
-            self.is_speaking = False
-            print(f"❌ Error generating speech: {e}")
-            import traceback
-            traceback.print_exc()
+            logger.exception("❌ Error generating speech: %s", e)
             return None
     
     def get_current_scores(self):
@@ -165,4 +302,5 @@ class VoiceDebateHandler:
     def cleanup(self):
         """Clean up resources"""
         self.is_speaking = False
-        print("🧹 Voice handler cleaned up")
+        self._io_pool.shutdown(wait=False)
+        logger.debug("🧹 Voice handler cleaned up")